@@ -0,0 +1,53 @@
+# Adaptive difficulty candidate sets.
+#
+# For every level, candidate_sets() lists the questions of all lower levels
+# (easier) and all higher levels (harder), leaving out the level's own
+# questions. The question catalog builds these once per version of the levels,
+# so apply_adaptive_difficulty only has to sample k IDs from a ready array.
+#
+# With answer history, order_by_success() sorts a candidate array by each
+# question's expected success rate, and sample_near() binary-searches for the
+# player's accuracy and samples from the 2k questions around it: the borrowed
+# questions are the ones students of that accuracy tend to get right about as
+# often as this player does.
+import bisect
+import random
+
+
+def _merge(id_lists, exclude):
+    merged = []
+    seen = set(exclude)
+    for ids in id_lists:
+        for qid in ids:
+            if qid not in seen:
+                seen.add(qid)
+                merged.append(qid)
+    return merged
+
+
+def candidate_sets(level_index):
+    """level number -> (easier IDs, harder IDs) from the levels below / above it"""
+    numbers = sorted(number for number in level_index if isinstance(number, int))
+    sets = {}
+    for position, number in enumerate(numbers):
+        own = level_index[number]
+        easier = _merge((level_index[n] for n in numbers[:position]), own)
+        harder = _merge((level_index[n] for n in numbers[position + 1:]), own)
+        sets[number] = (easier, harder)
+    return sets
+
+
+def order_by_success(question_ids, success_rates):
+    """(IDs sorted by expected success rate, the matching sorted rates)"""
+    ordered = sorted(question_ids, key=lambda qid: success_rates.get(qid, 0.5))
+    return ordered, [success_rates.get(qid, 0.5) for qid in ordered]
+
+
+def sample_near(ordered_ids, rates, target, k, rng=random):
+    """k IDs whose expected success rate is near target (ordered_ids sorted by rate)"""
+    if k >= len(ordered_ids):
+        return list(ordered_ids)
+    centre = bisect.bisect_left(rates, target)
+    high = min(len(ordered_ids), max(centre + k, 2 * k))
+    low = max(0, high - 2 * k)
+    return rng.sample(ordered_ids[low:high], k)
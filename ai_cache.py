@@ -0,0 +1,123 @@
+# Cache of AI provider responses.
+#
+# Responses are stored under a content address: a hash of the provider, model,
+# prompt and call parameters, so the same arrangement or generation request is
+# only paid for once until its entry expires. Identical requests that arrive
+# while the first one is still waiting on the provider are coalesced
+# ("single-flight"): they block on the leader's call and share its response
+# instead of sending their own. The cache is bounded by entry count and by the
+# total size of the stored responses, evicting least recently used entries.
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class ResponseCache:
+    """In-process LRU of provider responses with single-flight coalescing"""
+
+    def __init__(self, max_entries=256, max_bytes=16 * 1024 * 1024, ttl=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'stores': 0,
+            'uncacheable': 0,
+            'evictions': 0,
+            'expired': 0,
+        }
+
+    @staticmethod
+    def make_key(provider, model, prompt, params=None):
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        material = json.dumps([provider, model, prompt_hash, params or {}], sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get_or_call(self, key, fn, cacheable=None):
+        """Cached response for key, or the result of fn() (shared with concurrent callers).
+
+        Results for which cacheable(result) is false are handed to the callers
+        waiting on this flight but not stored.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry['expires_at'] > time.time():
+                    self._entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return entry['value']
+                self._drop(key)
+                self.counters['expired'] += 1
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = Future()
+                self._inflight[key] = flight
+                self.counters['misses'] += 1
+            else:
+                self.counters['coalesced'] += 1
+
+        if not leader:
+            return flight.result()
+
+        try:
+            value = fn()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.set_exception(e)
+            raise
+        with self._lock:
+            if cacheable is None or cacheable(value):
+                self._store(key, value)
+            else:
+                self.counters['uncacheable'] += 1
+            self._inflight.pop(key, None)
+        flight.set_result(value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _store(self, key, value):
+        # Called with the lock held
+        size = len(value if isinstance(value, str) else json.dumps(value, default=str))
+        if size > self.max_bytes:
+            self.counters['uncacheable'] += 1
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = {'value': value, 'size': size, 'expires_at': time.time() + self.ttl}
+        self._bytes += size
+        self.counters['stores'] += 1
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.counters['evictions'] += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry['size']
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            stats['in_flight'] = len(self._inflight)
+        requests = stats['hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_rate'] = round((stats['hits'] + stats['coalesced']) / requests, 3) if requests else 0.0
+        stats['max_entries'] = self.max_entries
+        stats['max_bytes'] = self.max_bytes
+        stats['ttl'] = self.ttl
+        return stats
@@ -0,0 +1,149 @@
+# Shared HTTP client for the AI providers.
+#
+# One ProviderClient per provider keeps a requests.Session with a keep-alive
+# connection pool, so concurrent grading calls reuse TLS connections instead of
+# opening a new one each time. Calls that never reached the provider
+# (connection errors and connect timeouts) and 429/5xx responses are retried
+# with jittered exponential backoff, waiting as long as the server's
+# Retry-After header asks for when it sends one. A read timeout is not retried:
+# the provider was already working on the request. Every call has an overall
+# deadline that caps the read timeout of later attempts and the backoff sleeps,
+# so retries never stretch one call past it. Latency,
+# retries and token usage are counted per provider for the teacher dashboard.
+import time
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ProviderClient:
+    """Pooled, retrying HTTP client with metrics for one AI provider"""
+
+    def __init__(self, name, connect_timeout=5, read_timeout=60, max_retries=3,
+                 backoff_base=0.5, backoff_max=8.0, retry_after_max=30.0, pool_size=20, deadline=None):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        # Total seconds one post() may take, retries included
+        self.deadline = deadline if deadline is not None else read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self.counters = {
+            'calls': 0,
+            'attempts': 0,
+            'retries': 0,
+            'errors': 0,
+            'rate_limited': 0,
+            'deadline_exceeded': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'total_tokens': 0,
+        }
+
+    def post(self, url, headers=None, json=None):
+        """POST with retries within the deadline; returns the last response or raises the last request error"""
+        started = time.time()
+        deadline = started + self.deadline
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                self._count('attempts')
+                remaining = max(0.1, deadline - time.time())
+                timeout = (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+                try:
+                    response = self.session.post(url, headers=headers, json=json, timeout=timeout)
+                except requests.ConnectionError as e:
+                    # Includes ConnectTimeout: the request never reached the provider
+                    delay = self._backoff(attempt)
+                    if attempt > self.max_retries or not self._time_for_retry(deadline, delay):
+                        self._count('errors')
+                        raise
+                    print(f"[AI] {self.name} request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+                except requests.Timeout:
+                    # Read timeout: waiting again would only make the slow tail longer
+                    self._count('errors')
+                    raise
+                else:
+                    if response.status_code == 429:
+                        self._count('rate_limited')
+                    if response.status_code not in RETRY_STATUSES:
+                        if response.status_code >= 400:
+                            self._count('errors')
+                        return response
+                    delay = self._retry_after(response)
+                    if delay is None:
+                        delay = self._backoff(attempt)
+                    if (attempt > self.max_retries or delay > self.retry_after_max
+                            or not self._time_for_retry(deadline, delay)):
+                        self._count('errors')
+                        return response
+                    print(f"[AI] {self.name} returned {response.status_code}, retrying in {delay:.1f}s")
+                self._count('retries')
+                time.sleep(delay)
+        finally:
+            with self._lock:
+                self.counters['calls'] += 1
+                self._latencies.append(time.time() - started)
+
+    def _time_for_retry(self, deadline, delay, min_attempt=1.0):
+        """Whether sleeping delay still leaves min_attempt seconds for another attempt"""
+        if time.time() + delay + min_attempt <= deadline:
+            return True
+        self._count('deadline_exceeded')
+        return False
+
+    def _backoff(self, attempt):
+        # Full jitter: a random wait up to base * 2^(attempt-1), capped
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+
+    def _retry_after(self, response):
+        """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def record_usage(self, prompt_tokens=0, completion_tokens=0, total_tokens=None):
+        with self._lock:
+            self.counters['prompt_tokens'] += prompt_tokens or 0
+            self.counters['completion_tokens'] += completion_tokens or 0
+            if total_tokens is None:
+                total_tokens = (prompt_tokens or 0) + (completion_tokens or 0)
+            self.counters['total_tokens'] += total_tokens or 0
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            latencies = sorted(self._latencies)
+        if latencies:
+            stats['latency_avg'] = round(sum(latencies) / len(latencies), 3)
+            stats['latency_p50'] = round(latencies[len(latencies) // 2], 3)
+            stats['latency_p95'] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+            stats['latency_max'] = round(latencies[-1], 3)
+        stats['timeout'] = list(self.timeout)
+        stats['deadline'] = self.deadline
+        return stats
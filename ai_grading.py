@@ -0,0 +1,256 @@
+# Background AI grading.
+#
+# GradingPool runs grading calls on a bounded thread pool so a request only
+# waits as long as its latency budget. A verdict that arrives within the budget
+# is returned to the caller; otherwise the job is marked deferred and the
+# on_late_result callback is invoked from the worker thread when it lands, while
+# the caller reconciles it later with collect().
+#
+# GradingBatcher sits underneath: concurrent grading requests that arrive
+# within a short window, from any player, are graded together in one provider
+# call. The batch prompt fences each answer as its own JSON item and verdicts
+# must name their item's id, so one student's answer cannot sway another's.
+import os
+import time
+import uuid
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+PENDING = 'pending'
+DEFERRED = 'deferred'
+DONE = 'done'
+
+
+class GradingPool:
+    """Bounded worker pool for AI grading with inline-or-deferred results"""
+
+    def __init__(self, workers=4, max_pending=64, on_late_result=None, result_ttl=3600):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.on_late_result = on_late_result
+        self.result_ttl = result_ttl
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self.counters = {
+            'submitted': 0,
+            'inline': 0,
+            'deferred': 0,
+            'late_results': 0,
+            'rejected': 0,
+            'failed': 0,
+        }
+
+    def _pool(self):
+        # Created lazily so each forked worker process gets its own threads
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ai-grading')
+        return self._executor
+
+    def submit(self, fn, *args, context=None, **kwargs):
+        """Start fn(*args, **kwargs) in the background; returns a job id, or None if the pool is full"""
+        with self._lock:
+            self._expire()
+            running = sum(1 for job in self._jobs.values() if job['state'] != DONE)
+            if running >= self.max_pending:
+                self.counters['rejected'] += 1
+                return None
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'state': PENDING,
+                'result': None,
+                'context': context or {},
+                'finished_event': threading.Event(),
+            }
+            self.counters['submitted'] += 1
+            future = self._pool().submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return job_id
+
+    def wait(self, job_id, budget):
+        """Result if the job finishes within budget seconds, otherwise None (the job is deferred)"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job['finished_event'].wait(budget)
+        with self._lock:
+            if job['state'] == DONE:
+                # Consumed inline; nothing left to reconcile
+                self._jobs.pop(job_id, None)
+                self.counters['inline'] += 1
+                return job['result']
+            job['state'] = DEFERRED
+            self.counters['deferred'] += 1
+            return None
+
+    def collect(self, job_id, timeout=0):
+        """(state, result) for a deferred job: state is 'pending', 'done' or 'unknown'.
+
+        A done result is handed out only once. 'unknown' means the job ran in
+        another process or was forgotten, so the caller has to look elsewhere.
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return 'unknown', None
+        if timeout:
+            job['finished_event'].wait(timeout)
+        with self._lock:
+            if job['state'] != DONE:
+                return 'pending', None
+            self._jobs.pop(job_id, None)
+            return 'done', job['result']
+
+    def _finish(self, job_id, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"[AI GRADING] Job failed: {e}")
+            self.counters['failed'] += 1
+            result = None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            late = job['state'] == DEFERRED
+            job['state'] = DONE
+            job['result'] = result
+            job['finished'] = time.time()
+            job['finished_event'].set()
+        if late:
+            self.counters['late_results'] += 1
+            if self.on_late_result is not None and result is not None:
+                try:
+                    self.on_late_result(result, job['context'])
+                except Exception as e:
+                    print(f"[AI GRADING] Late result callback failed: {e}")
+
+    def _expire(self):
+        # Forget results nobody came back for (called with the lock held)
+        cutoff = time.time() - self.result_ttl
+        for job_id in [j for j, job in self._jobs.items() if job['state'] == DONE and job.get('finished', 0) < cutoff]:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['running'] = sum(1 for job in self._jobs.values() if job['state'] != DONE)
+            stats['awaiting_collection'] = sum(1 for job in self._jobs.values() if job['state'] == DONE)
+        stats['workers'] = self.workers
+        stats['max_pending'] = self.max_pending
+        return stats
+
+
+class GradingBatcher:
+    """Packs concurrent grading requests into one provider call.
+
+    grade() queues an item and blocks until its verdict is ready (or the
+    timeout expires). A collector thread waits up to window seconds for more
+    items, then hands up to max_batch of them to grade_batch(items), which returns one verdict per item (None where the
+    response had nothing usable for it). Items missing from a batch response are
+    graded again one by one with grade_one(item).
+    """
+
+    def __init__(self, grade_batch, grade_one, max_batch=10, window=0.25, concurrency=2):
+        self.grade_batch = grade_batch
+        self.grade_one = grade_one
+        self.max_batch = max_batch
+        self.window = window
+        self.concurrency = concurrency
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._executor = None
+        self._pid = None
+        self.counters = {
+            'items': 0,
+            'batches': 0,
+            'batched_items': 0,
+            'retried_items': 0,
+            'failed_items': 0,
+            'timed_out_items': 0,
+        }
+
+    def grade(self, item, timeout=None):
+        """Verdict for one item, or None if it could not be graded in time"""
+        return self.grade_many([item], timeout=timeout)[0]
+
+    def grade_many(self, items, timeout=None):
+        """Verdicts for a list of items, in order (None for items not graded within timeout seconds)"""
+        futures = [self.submit(item) for item in items]
+        deadline = None if timeout is None else time.time() + timeout
+        verdicts = []
+        for future in futures:
+            try:
+                verdicts.append(future.result(timeout=None if deadline is None else max(0, deadline - time.time())))
+            except FutureTimeoutError:
+                self.counters['timed_out_items'] += 1
+                verdicts.append(None)
+        return verdicts
+
+    def submit(self, item):
+        """Queue an item; returns a Future for its verdict"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        self.counters['items'] += 1
+        return future
+
+    def _ensure_worker(self):
+        # Started lazily so each forked worker process gets its own threads
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='ai-batch')
+            self._thread = threading.Thread(target=self._collect, name='ai-batch-collector', daemon=True)
+            self._thread.start()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        items = [item for item, _ in batch]
+        self.counters['batches'] += 1
+        self.counters['batched_items'] += len(items)
+        try:
+            verdicts = list(self.grade_batch(items))
+        except Exception as e:
+            print(f"[AI GRADING] Batch of {len(items)} failed: {e}")
+            verdicts = []
+        verdicts += [None] * (len(items) - len(verdicts))
+
+        for (item, future), verdict in zip(batch, verdicts):
+            if verdict is None and len(batch) > 1:
+                # Partial failure: grade the leftovers on their own
+                self.counters['retried_items'] += 1
+                try:
+                    verdict = self.grade_one(item)
+                except Exception as e:
+                    print(f"[AI GRADING] Single retry failed: {e}")
+            if verdict is None:
+                self.counters['failed_items'] += 1
+            future.set_result(verdict)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['queued'] = self._queue.qsize()
+        stats['avg_batch_size'] = round(stats['batched_items'] / stats['batches'], 2) if stats['batches'] else 0
+        stats['max_batch'] = self.max_batch
+        stats['window'] = self.window
+        return stats
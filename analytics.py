@@ -0,0 +1,136 @@
+# Analytics event pipeline.
+#
+# Request handlers call AnalyticsPipeline.emit(), which only puts the event on a
+# bounded in-memory queue. A background flusher thread drains the queue in
+# batches and appends them to a JSON Lines log (one event per line). When the
+# log passes max_bytes it is rotated to a timestamped file, so the full history
+# is kept instead of only the newest events.
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+
+
+class AnalyticsPipeline:
+    """Bounded queue + background batch writer for analytics events"""
+
+    def __init__(self, path, max_queue=10000, batch_size=200, flush_interval=1.0,
+                 max_bytes=5 * 1024 * 1024, legacy_path=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.legacy_path = legacy_path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        # Back-pressure counters
+        self.counters = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'batches': 0,
+            'rotations': 0,
+            'write_errors': 0,
+        }
+        atexit.register(self.flush)
+
+    # ---- producer side ----
+    def emit(self, event):
+        """Queue one event; never blocks and never touches disk"""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(event)
+            self.counters['enqueued'] += 1
+            return True
+        except queue.Full:
+            # Queue full: the flusher can't keep up, drop instead of stalling the request
+            self.counters['dropped'] += 1
+            return False
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['queued'] = self._queue.qsize()
+        stats['queue_capacity'] = self._queue.maxsize
+        stats['log_path'] = self.path
+        return stats
+
+    # ---- flusher side ----
+    def _ensure_worker(self):
+        # Started lazily so each forked worker process gets its own flusher
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='analytics-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        self._import_legacy_log()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def flush(self):
+        """Write everything still queued (used at shutdown)"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            with self._lock:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in batch))
+                    size = f.tell()
+                if size >= self.max_bytes:
+                    self._rotate()
+            self.counters['written'] += len(batch)
+            self.counters['batches'] += 1
+        except Exception as e:
+            self.counters['write_errors'] += 1
+            print(f"[ANALYTICS] Failed to write {len(batch)} events: {e}")
+
+    def _rotate(self):
+        base, ext = os.path.splitext(self.path)
+        rotated = f"{base}-{time.strftime('%Y%m%d-%H%M%S')}{ext}"
+        suffix = 1
+        while os.path.exists(rotated):
+            rotated = f"{base}-{time.strftime('%Y%m%d-%H%M%S')}-{suffix}{ext}"
+            suffix += 1
+        os.replace(self.path, rotated)
+        self.counters['rotations'] += 1
+
+    def _import_legacy_log(self):
+        """Carry over events from the old data/analytics.json array once"""
+        if not self.legacy_path or os.path.exists(self.path) or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                events = json.load(f)
+            if isinstance(events, list) and events:
+                self._write(events)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[ANALYTICS] Could not import {self.legacy_path}: {e}")
@@ -0,0 +1,162 @@
+# Live feed of student answers for the real-time monitoring page.
+#
+# AnswerFeed.publish() hands each answer to two background workers: a
+# persister that appends batches to the storage log and a dispatcher that
+# pushes them to connected teachers. Neither disk writes nor Socket.IO sends
+# happen on the request that submitted the answer. The storage numbers every
+# stored answer with a sequence number shared by all worker processes, and
+# polling clients call since(seq) to read the answers they haven't seen yet
+# straight from the storage, so they see answers published by any worker.
+import os
+import time
+import queue
+import atexit
+import threading
+
+
+class AnswerFeed:
+    """Numbered log of recent answers with a background persister and dispatcher"""
+
+    def __init__(self, storage, log='student_answers', capacity=500, broadcast=None,
+                 max_queue=10000, batch_size=100, flush_interval=0.5):
+        self.storage = storage
+        self.log = log
+        self.capacity = capacity
+        self.broadcast = broadcast
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._persist_queue = queue.Queue(maxsize=max_queue)
+        self._dispatch_queue = queue.Queue(maxsize=max_queue)
+        self._workers_lock = threading.Lock()
+        self._workers = []
+        self._pid = None
+        self.counters = {
+            'published': 0,
+            'persisted': 0,
+            'dispatched': 0,
+            'persist_dropped': 0,
+            'dispatch_dropped': 0,
+            'persist_errors': 0,
+            'dispatch_errors': 0,
+        }
+        atexit.register(self.flush)
+
+    # ---- producer side ----
+    def publish(self, record):
+        """Queue an answer for the feed without blocking; it gets its seq once stored"""
+        self._ensure_workers()
+        self.counters['published'] += 1
+        try:
+            self._persist_queue.put_nowait(dict(record))
+        except queue.Full:
+            self.counters['persist_dropped'] += 1
+
+    # ---- reader side ----
+    def latest_seq(self):
+        return self.storage.last_number(self.log)
+
+    def recent(self, count=50):
+        """Newest count answers, newest first"""
+        if not count:
+            return []
+        records = self.storage.read_numbered(self.log, limit=count)
+        records.reverse()
+        return records
+
+    def since(self, seq, limit=None):
+        """Answers after seq, oldest first.
+
+        Returns (records, latest_seq, reset). reset is True when seq is ahead
+        of the stored log (it was replaced) or older than what the log still
+        keeps, so the client should drop what it has and use records as-is.
+        """
+        latest = self.storage.last_number(self.log)
+        if seq > latest:
+            records = self.storage.read_numbered(self.log, limit=self.capacity)
+            reset = True
+        else:
+            # The log is trimmed to about capacity answers, so reading it whole is cheap
+            records = self.storage.read_numbered(self.log)
+            # Corrected answers move to a new seq and leave gaps, so only a seq
+            # older than the oldest answer kept means answers were trimmed away
+            reset = bool(records) and records[0]['seq'] > seq + 1
+            records = [record for record in records if record['seq'] > seq]
+        if records:
+            latest = max(latest, records[-1]['seq'])
+        if limit is not None and len(records) > limit:
+            records = records[-limit:]
+        return records, latest, reset
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['latest_seq'] = self.latest_seq()
+        stats['capacity'] = self.capacity
+        stats['persist_queued'] = self._persist_queue.qsize()
+        stats['dispatch_queued'] = self._dispatch_queue.qsize()
+        return stats
+
+    # ---- workers ----
+    def _ensure_workers(self):
+        # Started lazily so each forked worker process gets its own threads
+        if self._pid == os.getpid() and all(t.is_alive() for t in self._workers):
+            return
+        with self._workers_lock:
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._workers):
+                return
+            self._pid = os.getpid()
+            self._workers = [threading.Thread(target=self._run_persister, name='answer-feed-persister', daemon=True)]
+            if self.broadcast is not None:
+                self._workers.append(threading.Thread(target=self._run_dispatcher, name='answer-feed-dispatcher', daemon=True))
+            for thread in self._workers:
+                thread.start()
+
+    def _run_persister(self):
+        while True:
+            batch = [self._persist_queue.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._persist_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._persist(batch)
+
+    def _persist(self, batch):
+        try:
+            batch = self.storage.append_numbered(self.log, batch, keep=self.capacity)
+            self.counters['persisted'] += len(batch)
+        except Exception as e:
+            self.counters['persist_errors'] += 1
+            print(f"[FEED] Failed to store {len(batch)} answers: {e}")
+        # Teachers are notified once the answer has its seq (or could not be stored)
+        if self.broadcast is not None:
+            for record in batch:
+                try:
+                    self._dispatch_queue.put_nowait(record)
+                except queue.Full:
+                    # A stalled socket must not grow memory without bound
+                    self.counters['dispatch_dropped'] += 1
+
+    def _run_dispatcher(self):
+        while True:
+            record = self._dispatch_queue.get()
+            try:
+                self.broadcast(record)
+                self.counters['dispatched'] += 1
+            except Exception as e:
+                self.counters['dispatch_errors'] += 1
+                print(f"[FEED] Broadcast failed: {e}")
+
+    def flush(self):
+        """Store everything still queued (used at shutdown)"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._persist_queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._persist(batch)
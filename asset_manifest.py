@@ -0,0 +1,194 @@
+# Enemy asset manifest.
+#
+# EnemyManifest loads data/enemies.json and scans static/enemies once, resolves
+# every enemy to an image file (explicit 'image' field, then a file named after
+# the enemy, then the file sharing the most name tokens) and records a short
+# content hash per image. Request handlers then resolve an enemy with a dict
+# lookup, and the hash goes into the image URL so browsers can cache it
+# forever: a changed image gets a new URL. A background watcher rebuilds the
+# manifest when enemies.json or the image directory changes; rebuild() does it
+# on demand.
+import os
+import json
+import time
+import hashlib
+import threading
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+
+
+def name_tokens(text):
+    return [t for t in ''.join(c if c.isalnum() else ' ' for c in str(text).lower()).split() if t]
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+class EnemyManifest:
+    """Enemies list plus enemy name -> (static path, content hash), rebuilt when the files change"""
+
+    def __init__(self, enemies_path, static_dir, image_dir='enemies', watch_interval=5.0):
+        self.enemies_path = enemies_path
+        self.static_dir = static_dir
+        self.image_dir = image_dir
+        self.watch_interval = watch_interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._signature = None
+        self._enemies = []
+        self._images = {}
+        self._files = {}
+        self.counters = {
+            'builds': 0,
+            'build_errors': 0,
+            'lookups': 0,
+            'unlisted_lookups': 0,
+        }
+        self.rebuild()
+
+    # ---- readers ----
+    def enemies(self):
+        """The enemies from enemies.json (shared list: do not modify)"""
+        self._ensure_watcher()
+        return self._enemies
+
+    def image(self, enemy):
+        """(path under static/, content hash or None) for an enemy dict, or (None, None)"""
+        self._ensure_watcher()
+        self.counters['lookups'] += 1
+        if not isinstance(enemy, dict):
+            return None, None
+        if enemy.get('image'):
+            path = enemy['image']
+            return path, self._files.get(path)
+        name = enemy.get('name')
+        if not name:
+            return None, None
+        images = self._images
+        if name not in images:
+            # An enemy that is not in enemies.json (e.g. the built-in fallback):
+            # resolve it against the scanned directory listing and remember it
+            self.counters['unlisted_lookups'] += 1
+            images = dict(images)
+            images[name] = self._resolve(name, self._files)
+            self._images = images
+        path = images[name]
+        return (path, self._files.get(path)) if path else (None, None)
+
+    # ---- building ----
+    def _current_signature(self):
+        signature = []
+        for path in [self.enemies_path] + self._image_paths():
+            try:
+                st = os.stat(path)
+                signature.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def _image_paths(self):
+        directory = os.path.join(self.static_dir, self.image_dir)
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            return []
+        return [os.path.join(directory, name) for name in names
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+
+    def rebuild(self):
+        """Reload enemies.json, rescan and rehash the images; returns stats"""
+        with self._lock:
+            signature = self._current_signature()
+            try:
+                with open(self.enemies_path, encoding='utf-8') as f:
+                    enemies = json.load(f)
+                if not isinstance(enemies, list):
+                    enemies = []
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"[ASSETS] Could not load {self.enemies_path}: {e}")
+                self.counters['build_errors'] += 1
+                enemies = []
+
+            files = {}
+            for path in self._image_paths():
+                relative = f"{self.image_dir}/{os.path.basename(path)}"
+                try:
+                    files[relative] = file_hash(path)
+                except OSError as e:
+                    print(f"[ASSETS] Could not hash {path}: {e}")
+            # Explicit image paths outside the scanned directory still get a hash
+            for enemy in enemies:
+                path = enemy.get('image') if isinstance(enemy, dict) else None
+                if path and path not in files:
+                    full_path = os.path.join(self.static_dir, path)
+                    if os.path.isfile(full_path):
+                        files[path] = file_hash(full_path)
+
+            images = {}
+            for enemy in enemies:
+                if isinstance(enemy, dict) and enemy.get('name') and not enemy.get('image'):
+                    images[enemy['name']] = self._resolve(enemy['name'], files)
+
+            self._enemies, self._files, self._images = enemies, files, images
+            self._signature = signature
+            self.counters['builds'] += 1
+        print(f"[ASSETS] Enemy manifest built: {len(enemies)} enemies, {len(files)} images")
+        return self.stats()
+
+    def _resolve(self, name, files):
+        """Image path for an enemy name: safe file name first, then the best token match"""
+        safe_base = ''.join(c if c.isalnum() else '_' for c in name.lower()).strip('_')
+        for ext in IMAGE_EXTENSIONS:
+            candidate = f"{self.image_dir}/{safe_base}{ext}"
+            if candidate in files:
+                return candidate
+
+        enemy_tokens = name_tokens(name)
+        best_match = None
+        best_score = 0
+        for candidate in files:
+            if not candidate.startswith(f"{self.image_dir}/"):
+                continue
+            file_tokens = name_tokens(os.path.splitext(candidate[len(self.image_dir) + 1:])[0])
+            score = sum(1 for t in enemy_tokens if t in file_tokens)
+            # If all tokens match it is a perfect match
+            if score == len(enemy_tokens) and score > 0:
+                return candidate
+            if score > best_score:
+                best_score = score
+                best_match = candidate
+        return best_match if best_score > 0 else None
+
+    # ---- watcher ----
+    def _ensure_watcher(self):
+        # Started lazily so each forked worker process gets its own thread
+        if not self.watch_interval or (self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._watch, name='enemy-manifest-watcher', daemon=True)
+            self._thread.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                if self._current_signature() != self._signature:
+                    self.rebuild()
+            except Exception as e:
+                print(f"[ASSETS] Manifest watcher failed: {e}")
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['enemies'] = len(self._enemies)
+        stats['images'] = len(self._files)
+        stats['resolved'] = {name: path for name, path in self._images.items()}
+        return stats
@@ -22,4 +22,99 @@ AI_MODEL = GEMINI_MODEL if AI_PROVIDER == "gemini" else OPENAI_MODEL
 # File upload configuration
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx', 'md'}
-MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
\ No newline at end of file
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+
+# Storage configuration
+# "sqlite" keeps leaderboards, students, progress, chapters, pools and logs in one
+# WAL-mode database (imported from data/*.json on first start); "json" uses the files directly
+# and only supports a single worker process (the live answer feed is numbered in-process)
+STORAGE_BACKEND = "sqlite"
+STORAGE_DB_PATH = 'data/app.db'
+
+# Session configuration
+# "sqlite" or "filesystem" keep session data on the server and the cookie only holds
+# a session ID; "cookie" keeps Flask's default signed-cookie sessions
+SESSION_BACKEND = "sqlite"
+SESSION_DB_PATH = 'data/sessions.db'
+SESSION_DIR = 'data/sessions'
+
+# Analytics configuration
+# Events are queued in memory and written in batches by a background thread to a
+# JSON Lines log that is rotated to a timestamped file once it reaches the size limit
+ANALYTICS_LOG_PATH = 'data/analytics/events.jsonl'
+ANALYTICS_QUEUE_SIZE = 10000
+ANALYTICS_MAX_BYTES = 5 * 1024 * 1024
+
+# AI provider HTTP client
+# Connections are pooled and kept alive; connect/read timeouts are in seconds per provider.
+# Rate-limited (429), 5xx and dropped calls are retried with jittered exponential backoff.
+AI_TIMEOUTS = {
+    "gemini": (5, 60),
+    "openai": (5, 60),
+}
+AI_MAX_RETRIES = 3
+AI_BACKOFF_MAX = 8.0
+# Seconds one provider call may take in total, retries and backoff included
+AI_CALL_DEADLINE = 60
+AI_POOL_SIZE = 20
+
+# AI grading verdict cache
+# Verdicts are reused for the same question and (normalized) student answer
+AI_VERDICT_CACHE_SIZE = 2048  # entries kept in memory
+AI_VERDICT_TTL = 7 * 24 * 3600  # seconds before a stored verdict is graded again
+
+# Background AI grading
+# game() waits at most AI_GRADING_BUDGET seconds for an AI verdict; slower verdicts
+# are applied to the player's score, or to the saved game once it has ended, when they arrive
+AI_GRADING_WORKERS = 4
+AI_GRADING_MAX_PENDING = 64
+AI_GRADING_BUDGET = 3.0
+AI_GRADING_PENDING_TTL = 300
+
+# Batched AI grading
+# Grading requests arriving within AI_BATCH_WINDOW seconds share one provider call
+AI_BATCH_SIZE = 10
+AI_BATCH_WINDOW = 0.25
+AI_BATCH_CONCURRENCY = 2
+# Seconds a grading request waits for its batch before giving up with an error verdict
+AI_GRADING_TIMEOUT = 75
+
+# Question generation from uploaded documents
+# The text is split into overlapping chunks; when it is too long to send whole,
+# each chunk is first summarized (concurrently) and the questions are written from the notes
+AI_GEN_CHUNK_CHARS = 4000
+AI_GEN_CHUNK_OVERLAP = 400
+AI_GEN_MAX_PER_CALL = 10  # questions asked for in one AI call
+AI_GEN_MAX_CALL_CHARS = 12000  # document text sent with one AI call (several chunks share a call)
+AI_GEN_CONCURRENCY = 4
+AI_GEN_MIN_NOTES_CHARS = 300  # shortest summary asked for per chunk (long documents get more calls instead)
+
+# Text extraction for uploaded documents
+# PDF/DOCX parsing runs in a worker process; extracted text is cached by file content
+TEXT_CACHE_DIR = 'data/text_cache'
+TEXT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+TEXT_EXTRACT_TIMEOUT = 120  # seconds before a parse is abandoned
+TEXT_EXTRACT_WORKERS = 1
+
+# AI response cache for arrangement and question generation prompts
+# Identical prompts (same provider, model and parameters) reuse the stored response
+AI_RESPONSE_CACHE_SIZE = 256  # entries kept in memory
+AI_RESPONSE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+AI_RESPONSE_CACHE_TTL = 3600  # seconds
+
+# AI question arrangement
+# Chapters larger than AI_ARRANGE_BATCH_SIZE are arranged in concurrent batches and merged
+AI_ARRANGE_BATCH_SIZE = 50  # questions per AI prompt
+AI_ARRANGE_CONCURRENCY = 4
+
+# Enemy image manifest
+# Seconds between checks of data/enemies.json and static/enemies for changes (0 disables the watcher)
+ENEMY_MANIFEST_WATCH_INTERVAL = 5.0
+
+# Adaptive difficulty
+# Seconds between refreshes of the answer-history success rates used to pick borrowed questions
+ADAPTIVE_HISTORY_REFRESH = 300
+
+# Test Yourself bundles
+# Seconds after the time limit during which a bundled test can still be submitted (covers network delay)
+TEST_BUNDLE_GRACE = 30
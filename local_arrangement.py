@@ -0,0 +1,318 @@
+# Offline question arrangement.
+#
+# QuestionStats keeps attempt/correct counts per question. Answers are counted
+# in memory and a background thread adds them to a storage table every few
+# seconds, so recording an answer costs no I/O. Difficulty is estimated from the
+# observed success rate, shrunk towards a prior built from the success rates of
+# questions that share keywords (and the question's type and length when
+# nothing is known), so new questions still get a sensible place.
+#
+# Topics are found without a model call: every question becomes a sparse TF-IDF
+# vector over its text and keywords, and the vectors are grouped with spherical
+# k-means. Everything here runs in-process in milliseconds; the AI arrangement
+# helpers in app.py can refine the result.
+import os
+import math
+import time
+import atexit
+import random
+import re
+import threading
+from collections import Counter
+
+STOPWORDS = set("""
+a an and are as at be by can do does for from how in is it its of on or that the this to
+what when where which who why will with you your into if not no yes true false than then
+use used using command following
+""".split())
+
+
+class QuestionStats:
+    """Attempt/correct counts per question with background flushing to storage"""
+
+    def __init__(self, storage, table='question_stats', seed_log='student_answers', flush_interval=5.0):
+        self.storage = storage
+        self.table = table
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.counters = {
+            'recorded': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+        }
+        self._seed(seed_log)
+        atexit.register(self.flush)
+
+    def _seed(self, seed_log):
+        """Count the answers already in the answer log the first time the table is used"""
+        try:
+            if self.storage.all_rows(self.table):
+                return
+            rows = {}
+            for record in self.storage.all_records(seed_log):
+                if record.get('question_id') is None:
+                    continue
+                row = rows.setdefault(str(record['question_id']), {'attempts': 0, 'correct': 0})
+                row['attempts'] += 1
+                row['correct'] += 1 if record.get('is_correct') else 0
+            if rows:
+                self.storage.replace_rows(self.table, rows)
+                print(f"[STATS] Seeded answer statistics for {len(rows)} questions")
+        except Exception as e:
+            print(f"[STATS] Could not seed answer statistics: {e}")
+
+    def record(self, question_id, is_correct):
+        if question_id is None:
+            return
+        self._ensure_worker()
+        with self._lock:
+            pending = self._pending.setdefault(str(question_id), [0, 0])
+            pending[0] += 1
+            pending[1] += 1 if is_correct else 0
+        self.counters['recorded'] += 1
+
+    def counts(self):
+        """question id (as a string) -> (attempts, correct), including unflushed answers"""
+        try:
+            rows = self.storage.all_rows(self.table)
+        except Exception as e:
+            print(f"[STATS] Could not read answer statistics: {e}")
+            rows = {}
+        counts = {key: (row.get('attempts', 0), row.get('correct', 0)) for key, row in rows.items()}
+        with self._lock:
+            for key, (attempts, correct) in self._pending.items():
+                stored = counts.get(key, (0, 0))
+                counts[key] = (stored[0] + attempts, stored[1] + correct)
+        return counts
+
+    def _ensure_worker(self):
+        # Started lazily so each forked worker process gets its own thread
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='question-stats', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Add the counted answers to the stored totals"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        failed = {}
+        for key, (attempts, correct) in pending.items():
+            try:
+                self.storage.update_row(
+                    self.table, key,
+                    lambda row, a=attempts, c=correct: {'attempts': row['attempts'] + a, 'correct': row['correct'] + c},
+                    default={'attempts': 0, 'correct': 0})
+            except Exception as e:
+                self.counters['flush_errors'] += 1
+                failed[key] = (attempts, correct)
+                print(f"[STATS] Failed to store answer statistics for question {key}: {e}")
+        if failed:
+            # Put the counts back so the next flush tries them again
+            with self._lock:
+                for key, (attempts, correct) in failed.items():
+                    merged = self._pending.setdefault(key, [0, 0])
+                    merged[0] += attempts
+                    merged[1] += correct
+        if len(pending) > len(failed):
+            self.counters['flushes'] += 1
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['pending_questions'] = len(self._pending)
+        return stats
+
+
+# ------------------- DIFFICULTY -------------------
+TYPE_DIFFICULTY = {'true_false': 0.2, 'multiple_choice': 0.4, 'short_answer': 0.7}
+
+
+def question_keywords(question):
+    keywords = question.get('keywords', [])
+    if isinstance(keywords, str):
+        keywords = keywords.split(',')
+    return [str(k).strip().lower() for k in keywords if str(k).strip()]
+
+
+def structural_difficulty(question):
+    """0..1 guess from the question itself: type, answer length and question length"""
+    type_score = TYPE_DIFFICULTY.get(question.get('type', 'short_answer'), 0.5)
+    answer_words = len(str(question.get('answer', '')).split())
+    question_words = len(str(question.get('q', '')).split())
+    return (0.6 * type_score
+            + 0.25 * min(1.0, (answer_words - 1) / 5)
+            + 0.15 * min(1.0, question_words / 30))
+
+
+def difficulty_scores(questions, counts, prior_strength=5):
+    """question id -> estimated difficulty (1 - expected success rate)"""
+    total_attempts = sum(attempts for attempts, _ in counts.values())
+    total_correct = sum(correct for _, correct in counts.values())
+    global_rate = total_correct / total_attempts if total_attempts else 0.7
+
+    # Success rate per keyword over every question the students have answered
+    keyword_totals = {}
+    for question in questions:
+        attempts, correct = counts.get(str(question.get('id')), (0, 0))
+        if not attempts:
+            continue
+        for keyword in question_keywords(question):
+            totals = keyword_totals.setdefault(keyword, [0, 0])
+            totals[0] += attempts
+            totals[1] += correct
+
+    scores = {}
+    for question in questions:
+        rates = []
+        for keyword in question_keywords(question):
+            if keyword in keyword_totals:
+                attempts, correct = keyword_totals[keyword]
+                rates.append((correct + prior_strength * global_rate) / (attempts + prior_strength))
+        prior = sum(rates) / len(rates) if rates else global_rate
+        prior = min(0.99, max(0.01, prior - 0.3 * (structural_difficulty(question) - 0.5)))
+        attempts, correct = counts.get(str(question.get('id')), (0, 0))
+        scores[question.get('id')] = 1 - (correct + prior_strength * prior) / (attempts + prior_strength)
+    return scores
+
+
+# ------------------- TOPICS -------------------
+def tokenize(text):
+    return [w for w in re.findall(r'[a-z0-9]+', str(text).lower()) if len(w) > 1 and w not in STOPWORDS]
+
+
+def tfidf_vectors(questions, keyword_weight=2):
+    """One L2-normalised sparse TF-IDF vector (term -> weight) per question"""
+    term_counts = []
+    for question in questions:
+        counts = Counter(tokenize(question.get('q', '')))
+        for keyword in question_keywords(question):
+            for term in tokenize(keyword):
+                counts[term] += keyword_weight
+        term_counts.append(counts)
+    document_frequency = Counter(term for counts in term_counts for term in counts)
+    n = len(questions)
+    vectors = []
+    for counts in term_counts:
+        vector = {term: (1 + math.log(count)) * (math.log((1 + n) / (1 + document_frequency[term])) + 1)
+                  for term, count in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        vectors.append({term: w / norm for term, w in vector.items()})
+    return vectors
+
+
+def spherical_kmeans(vectors, k, iterations=15, seed=0):
+    """Cluster sparse unit vectors by cosine similarity; returns a cluster index per vector"""
+    rng = random.Random(seed)
+    # k-means++ seeding: spread the first centroids over dissimilar questions
+    centroids = [dict(vectors[rng.randrange(len(vectors))])]
+    closest = [1 - sparse_dot(v, centroids[0]) for v in vectors]
+    while len(centroids) < k:
+        total = sum(closest)
+        if total <= 0:
+            break
+        pick = rng.uniform(0, total)
+        for index, distance in enumerate(closest):
+            pick -= distance
+            if pick <= 0:
+                break
+        centroids.append(dict(vectors[index]))
+        closest = [min(d, 1 - sparse_dot(v, centroids[-1])) for d, v in zip(closest, vectors)]
+
+    assignment = [-1] * len(vectors)
+    for _ in range(iterations):
+        changed = False
+        for index, vector in enumerate(vectors):
+            best = max(range(len(centroids)), key=lambda c: sparse_dot(vector, centroids[c]))
+            if best != assignment[index]:
+                assignment[index] = best
+                changed = True
+        if not changed:
+            break
+        sums = [Counter() for _ in centroids]
+        for vector, cluster in zip(vectors, assignment):
+            sums[cluster].update(vector)
+        for cluster, total in enumerate(sums):
+            norm = math.sqrt(sum(w * w for w in total.values()))
+            if norm:
+                centroids[cluster] = {term: w / norm for term, w in total.items()}
+    return assignment, centroids
+
+
+def sparse_dot(vector, centroid):
+    if len(vector) > len(centroid):
+        vector, centroid = centroid, vector
+    return sum(w * centroid.get(term, 0.0) for term, w in vector.items())
+
+
+def topic_clusters(questions, k=None):
+    """[{'name': ..., 'question_ids': [...]}, ...] grouping questions by shared vocabulary"""
+    if not questions:
+        return []
+    if k is None:
+        k = round(math.sqrt(len(questions) / 2))
+    k = max(1, min(k, 12, len(questions)))
+    vectors = tfidf_vectors(questions)
+    assignment, centroids = spherical_kmeans(vectors, k)
+    clusters = {}
+    for question, cluster in zip(questions, assignment):
+        clusters.setdefault(cluster, []).append(question.get('id'))
+    result = []
+    for cluster, question_ids in clusters.items():
+        top_terms = sorted(centroids[cluster].items(), key=lambda item: -item[1])[:2]
+        result.append({'name': ' / '.join(term for term, _ in top_terms) or 'general', 'question_ids': question_ids})
+    return result
+
+
+# ------------------- ARRANGEMENT -------------------
+def arrange_locally(questions, strategy, counts, num_levels=10):
+    """Ordered question ids for difficulty/topic/learning_path, or level assignments for balanced"""
+    scores = difficulty_scores(questions, counts)
+    by_difficulty = sorted((q.get('id') for q in questions), key=lambda qid: scores[qid])
+
+    if strategy == 'difficulty':
+        return by_difficulty
+
+    if strategy == 'balanced':
+        # Deal the difficulty-sorted questions out in a snake so every level gets the same mix
+        levels = [[] for _ in range(num_levels)]
+        for index, qid in enumerate(by_difficulty):
+            row, column = divmod(index, num_levels)
+            levels[column if row % 2 == 0 else num_levels - 1 - column].append(qid)
+        return [{'level': number + 1, 'question_ids': level_ids} for number, level_ids in enumerate(levels)]
+
+    clusters = topic_clusters(questions)
+    for cluster in clusters:
+        cluster['question_ids'].sort(key=lambda qid: scores[qid])
+        cluster['difficulty'] = sum(scores[qid] for qid in cluster['question_ids']) / len(cluster['question_ids'])
+
+    if strategy == 'topic':
+        # Topics from easiest to hardest, easier questions first within each topic
+        clusters.sort(key=lambda cluster: cluster['difficulty'])
+        return [qid for cluster in clusters for qid in cluster['question_ids']]
+
+    if strategy == 'learning_path':
+        # Easy to hard overall, but questions of one topic stay together within each level-sized band
+        cluster_of = {qid: index for index, cluster in enumerate(clusters) for qid in cluster['question_ids']}
+        band_size = max(1, math.ceil(len(by_difficulty) / num_levels))
+        ordered = []
+        for start in range(0, len(by_difficulty), band_size):
+            band = by_difficulty[start:start + band_size]
+            first_seen = {}
+            for position, qid in enumerate(band):
+                first_seen.setdefault(cluster_of[qid], position)
+            ordered.extend(sorted(band, key=lambda qid: (first_seen[cluster_of[qid]], scores[qid])))
+        return ordered
+
+    raise ValueError(f"Unknown arrangement strategy: {strategy}")
@@ -0,0 +1,61 @@
+# Test Yourself question bundles.
+#
+# In bundle mode the whole test goes to the browser at once: the selected
+# questions without their answers, plus a token describing the test (bundle
+# ID, chapter, question IDs, start time and time limit). The token is that
+# description as compact JSON, signed with HMAC-SHA256 under the app's secret
+# key, so when all the answers come back in one request the server knows which
+# questions were asked and when the test started without having kept any
+# per-question state. The bundle ID is also kept in the session so a bundle is
+# graded only once; sending it again returns the stored result.
+import hmac
+import json
+import base64
+import hashlib
+import secrets
+
+
+class BundleError(ValueError):
+    """A bundle token that is malformed, tampered with or not for this test"""
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _signature(secret, body):
+    key = secret.encode() if isinstance(secret, str) else secret
+    return _b64encode(hmac.new(key, b'test-bundle:' + body.encode(), hashlib.sha256).digest())
+
+
+def sign_bundle(secret, chapter_id, question_ids, started, time_limit):
+    """(bundle ID, token) for a new test"""
+    bundle_id = secrets.token_urlsafe(8)
+    description = {'b': bundle_id, 'c': chapter_id, 'q': list(question_ids),
+                   's': int(started), 't': int(time_limit)}
+    body = _b64encode(json.dumps(description, separators=(',', ':')).encode())
+    return bundle_id, f"{body}.{_signature(secret, body)}"
+
+
+def read_bundle(secret, token):
+    """The test described by a token as {'bundle_id', 'chapter_id', 'question_ids', 'started', 'time_limit'}"""
+    if not isinstance(token, str) or token.count('.') != 1:
+        raise BundleError('Malformed test bundle token')
+    body, signature = token.split('.')
+    if not hmac.compare_digest(signature.encode(), _signature(secret, body).encode()):
+        raise BundleError('Test bundle signature does not match')
+    try:
+        description = json.loads(_b64decode(body))
+        return {
+            'bundle_id': description['b'],
+            'chapter_id': description['c'],
+            'question_ids': description['q'],
+            'started': description['s'],
+            'time_limit': description['t']
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        raise BundleError(f"Unreadable test bundle token: {e}")
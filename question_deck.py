@@ -0,0 +1,65 @@
+# Shuffled-deck question sampler.
+#
+# A deck is a pseudo-random permutation of a question pool, stored as nothing
+# more than a seed and a cursor: permuted_index() computes the n-th position of
+# the permutation directly with a small keyed Feistel network (cycle-walking
+# keeps it inside the pool size), so drawing is O(1) and no shuffled list has
+# to be kept in the session. Every question comes up once per pass. A new pass,
+# or a pool that changed since the deck was made (detected by its fingerprint),
+# starts a fresh deck whose first card is not the question just shown.
+import random
+import hashlib
+
+FEISTEL_ROUNDS = 4
+
+
+def _round_value(value, round_number, seed):
+    digest = hashlib.blake2b(f"{seed}:{round_number}:{value}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def permuted_index(index, size, seed):
+    """Position of index in a seed-determined permutation of range(size)"""
+    bits = max(2, (size - 1).bit_length())
+    bits += bits % 2
+    half = bits // 2
+    mask = (1 << half) - 1
+    value = index
+    while True:
+        left, right = value >> half, value & mask
+        for round_number in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ (_round_value(right, round_number, seed) & mask)
+        value = (left << half) | right
+        # The cipher permutes a power-of-two range; walk the cycle until we land inside size
+        if value < size:
+            return value
+
+
+def pool_fingerprint(question_ids):
+    """Short hash of a pool's question IDs, to notice when the pool was edited"""
+    return hashlib.blake2b(','.join(map(str, question_ids)).encode(), digest_size=6).hexdigest()
+
+
+def new_deck(question_ids, fingerprint, avoid=None, passes=0):
+    """Fresh deck over question_ids whose first card is not avoid (when there is a choice)"""
+    size = len(question_ids)
+    seed = random.getrandbits(32)
+    if avoid is not None and size > 1:
+        for _ in range(8):
+            if question_ids[permuted_index(0, size, seed)] != avoid:
+                break
+            seed = random.getrandbits(32)
+    return {'seed': seed, 'cursor': 0, 'size': size, 'pool': fingerprint, 'passes': passes}
+
+
+def draw_from_deck(deck, question_ids, fingerprint, avoid=None):
+    """(next question ID, deck); the deck is reshuffled after a full pass or when the pool changed"""
+    if not question_ids:
+        return None, deck
+    if not deck or deck.get('pool') != fingerprint or deck.get('size') != len(question_ids):
+        deck = new_deck(question_ids, fingerprint, avoid)
+    elif deck['cursor'] >= deck['size']:
+        deck = new_deck(question_ids, fingerprint, avoid, passes=deck.get('passes', 0) + 1)
+    question_id = question_ids[permuted_index(deck['cursor'], deck['size'], deck['seed'])]
+    deck['cursor'] += 1
+    return question_id, deck
@@ -0,0 +1,230 @@
+# Server-side Flask sessions: the cookie only carries a random session ID and
+# the session data is kept in a SessionStore.
+#
+# Stores implement get/set/delete/sweep:
+#   SQLiteSessionStore - one table in a WAL-mode SQLite database
+#   FileSessionStore   - one file per session in a directory
+# A Redis-like store maps directly onto the same interface (GET, SETEX, DEL,
+# and sweep() as a no-op because keys expire by themselves).
+import os
+import time
+import sqlite3
+import hashlib
+import secrets
+import threading
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its ID and whether it was changed"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class SessionStore:
+    """Interface for server-side session backends"""
+
+    def get(self, sid):
+        """Return the serialized session, or None if it is missing or expired"""
+        raise NotImplementedError
+
+    def set(self, sid, data, expires_at):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def sweep(self, now=None):
+        """Delete expired sessions, returns how many were removed"""
+        raise NotImplementedError
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a WAL-mode SQLite table, shared by every worker process"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid):
+        row = self._conn().execute(
+            "SELECT data FROM sessions WHERE sid = ? AND expires_at > ?", (sid, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid, data, expires_at):
+        self._conn().execute(
+            "INSERT INTO sessions (sid, data, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(sid) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+            (sid, data, expires_at)
+        )
+
+    def delete(self, sid):
+        self._conn().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        return self._conn().execute("DELETE FROM sessions WHERE expires_at <= ?", (now,)).rowcount
+
+
+class FileSessionStore(SessionStore):
+    """One file per session: the expiry time on the first line, then the data"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        # Hash the ID so a cookie value can never name a path outside the directory
+        return os.path.join(self.directory, hashlib.sha256(sid.encode('utf-8')).hexdigest() + '.session')
+
+    def _read(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            expires_at = float(f.readline())
+            return expires_at, f.read()
+
+    def get(self, sid):
+        try:
+            expires_at, data = self._read(self._path(sid))
+        except (OSError, ValueError):
+            return None
+        return data if expires_at > time.time() else None
+
+    def set(self, sid, data, expires_at):
+        path = self._path(sid)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f"{expires_at}\n{data}")
+        os.replace(tmp_path, path)
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except OSError:
+            pass
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        removed = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.session'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if self._read(path)[0] <= now:
+                    os.remove(path)
+                    removed += 1
+            except (OSError, ValueError):
+                continue
+        return removed
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface that keeps session data in a SessionStore.
+
+    lifetime is a callable returning the idle lifetime in seconds, so it can
+    follow a setting that changes at runtime. Expired sessions are swept at
+    most once per sweep_interval seconds.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, lifetime, sweep_interval=300):
+        self.store = store
+        self.lifetime = lifetime
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0
+
+    def _new_session(self):
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid or len(sid) > 128:
+            return self._new_session()
+        data = self.store.get(sid)
+        if data is None:
+            return self._new_session()
+        try:
+            return ServerSideSession(self.serializer.loads(data), sid=sid)
+        except Exception as e:
+            print(f"[SESSION] Discarding unreadable session: {e}")
+            return self._new_session()
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        try:
+            removed = self.store.sweep(now)
+            if removed:
+                print(f"[SESSION] Swept {removed} expired sessions")
+        except Exception as e:
+            print(f"[SESSION] Sweep failed: {e}")
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # Emptied session: drop the stored copy and the cookie
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app))
+            return
+
+        self._maybe_sweep()
+        if session.new or self.should_set_cookie(app, session):
+            # Writing the session also pushes its expiry back by one lifetime
+            expires_at = time.time() + self.lifetime()
+            self.store.set(session.sid, self.serializer.dumps(dict(session)), expires_at)
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+        response.vary.add("Cookie")
+
+
+def open_session_interface(backend='sqlite', lifetime=lambda: 1800, db_path='data/sessions.db', directory='data/sessions'):
+    """Session interface for the configured backend, or None to keep Flask's cookie sessions"""
+    if backend == 'cookie':
+        return None
+    if backend == 'sqlite':
+        return ServerSideSessionInterface(SQLiteSessionStore(db_path), lifetime)
+    if backend == 'filesystem':
+        return ServerSideSessionInterface(FileSessionStore(directory), lifetime)
+    raise ValueError(f"Unknown session backend: {backend}")
@@ -0,0 +1,153 @@
+// In-place answering for the game pages.
+//
+// AnswerApi.attach() sends the answer form to /api/v1/answer and hands the
+// response (feedback plus the next question) to the page, which updates itself
+// without a redirect or a reload. If the request fails the form is posted the
+// normal way, so the pages keep working without the API.
+(function () {
+    const OPTION_LETTERS = ['A', 'B', 'C', 'D'];
+
+    function element(tag, className, text) {
+        const node = document.createElement(tag);
+        if (className) {
+            node.className = className;
+        }
+        if (text !== undefined) {
+            node.textContent = text;
+        }
+        return node;
+    }
+
+    function choiceButtons(choices, buttonClass, submitButton, hidden) {
+        // choices: [{label: [[className, text], ...], value, shown}]
+        const display = element('div', 'selected-answer');
+        const selectedText = element('span');
+        display.style.display = 'none';
+        display.append('Selected: ', selectedText);
+        const buttons = choices.map(function (choice) {
+            const button = element('div', buttonClass);
+            choice.label.forEach(function (part) {
+                button.appendChild(element('span', part[0], part[1]));
+            });
+            button.addEventListener('click', function () {
+                buttons.forEach(function (other) {
+                    other.classList.remove('selected');
+                });
+                button.classList.add('selected');
+                hidden.value = choice.value;
+                display.style.display = 'block';
+                selectedText.textContent = choice.shown;
+                submitButton.disabled = false;
+            });
+            return button;
+        });
+        return {buttons: buttons, display: display};
+    }
+
+    // Rebuild the answer form for a question payload from the API
+    function renderAnswerForm(form, question, options) {
+        const type = question.type || 'short_answer';
+        form.innerHTML = '';
+        if (type === 'multiple_choice' || type === 'true_false') {
+            const hidden = element('input');
+            hidden.type = 'hidden';
+            hidden.name = 'answer';
+            hidden.required = true;
+            const submitButton = element('button', 'btn', options.submitLabel);
+            submitButton.type = 'submit';
+            submitButton.disabled = true;
+            let choices;
+            let container;
+            if (type === 'multiple_choice') {
+                submitButton.id = options.submitId;
+                container = element('div', 'answer-options');
+                choices = (question.options || []).slice(0, OPTION_LETTERS.length).map(function (text, i) {
+                    return {
+                        label: [['option-letter', OPTION_LETTERS[i] + ')'], ['option-text', text]],
+                        value: text,
+                        shown: OPTION_LETTERS[i] + ') ' + text
+                    };
+                });
+            } else {
+                submitButton.id = options.tfSubmitId;
+                container = element('div', 'tf-buttons');
+                choices = [
+                    {label: [['tf-icon', '✓'], ['tf-text', 'True']], value: 'True', shown: 'True'},
+                    {label: [['tf-icon', '✗'], ['tf-text', 'False']], value: 'False', shown: 'False'}
+                ];
+            }
+            const built = choiceButtons(choices, type === 'multiple_choice' ? 'option-button' : 'tf-button', submitButton, hidden);
+            built.buttons.forEach(function (button) {
+                container.appendChild(button);
+            });
+            form.append(container, hidden, built.display, submitButton);
+        } else {
+            const input = element('input', 'short-answer-input');
+            input.type = 'text';
+            input.name = 'answer';
+            input.placeholder = 'Type your answer...';
+            input.required = true;
+            input.autocomplete = 'off';
+            const submitButton = element('button', 'btn', options.submitLabel);
+            submitButton.type = 'submit';
+            form.append(input, submitButton);
+            input.focus();
+        }
+    }
+
+    // Submit the form through the API; onResult(result) gets responses that stay on the page
+    function attach(form, mode, onResult) {
+        let busy = false;
+        form.addEventListener('submit', function (event) {
+            event.preventDefault();
+            if (busy) {
+                return;
+            }
+            busy = true;
+            const answer = new FormData(form).get('answer') || '';
+            fetch('/api/v1/answer', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                credentials: 'same-origin',
+                body: JSON.stringify({mode: mode, answer: answer})
+            })
+                .then(function (response) {
+                    if (!response.ok) {
+                        throw new Error('HTTP ' + response.status);
+                    }
+                    return response;
+                })
+                .then(function (response) {
+                    // The answer is graded by now: never post it a second time
+                    return response.json()
+                        .then(function (result) {
+                            busy = false;
+                            if (result.redirect || !result.next) {
+                                window.location.href = result.redirect || window.location.href;
+                                return;
+                            }
+                            onResult(result);
+                        })
+                        .catch(function (error) {
+                            console.log('Could not show the answer result, reloading:', error);
+                            window.location.reload();
+                        });
+                }, function (error) {
+                    // Only a failed request or an error status falls back to the plain form
+                    console.log('Answer API unavailable, posting the form instead:', error);
+                    form.submit();
+                });
+        });
+    }
+
+    // Submit a form so that the API handler sees it (form.submit() skips submit listeners)
+    function submitForm(form) {
+        if (form.requestSubmit) {
+            form.requestSubmit();
+        } else {
+            form.submit();
+        }
+    }
+
+    window.AnswerApi = {attach: attach, renderAnswerForm: renderAnswerForm, submitForm: submitForm};
+})();
@@ -0,0 +1,753 @@
+# Storage layer for the mutable game data (leaderboards, students, progress,
+# chapters, question pools, cached AI verdicts and the live answer log).
+#
+# Two backends implement the same repository interface:
+#   JsonStorage   - the original data/*.json files; logs are append-only
+#                   JSON Lines journals (data/*.jsonl)
+#   SQLiteStorage - one SQLite database in WAL mode with per-row writes
+#
+# app.py only talks to the object returned by open_storage(), so switching
+# STORAGE_BACKEND in config.py does not touch any route code.
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Keyed collections: name -> (legacy JSON file, key field)
+# A key field of None means the legacy file is a JSON object keyed by record key.
+KEYED_TABLES = {
+    'students': ('students.json', 'id'),
+    'student_progress': ('student_progress.json', None),
+    'ai_verdicts': ('ai_verdicts.json', None),
+    'question_stats': ('question_stats.json', None),
+}
+
+# Append-only record logs: name -> legacy JSON file (a JSON array).
+# JsonStorage journals them to the matching .jsonl file, one record per line.
+RECORD_LOGS = {
+    'leaderboard': 'leaderboard.json',
+    'guest_leaderboard': 'guest_leaderboard.json',
+    'student_answers': 'student_answers_log.json',
+}
+
+# Whole documents that are small and only edited from the teacher portal
+DOCUMENTS = {
+    'chapters': 'chapters.json',
+    'question_pools': 'question_pools.json',
+}
+
+
+class Storage:
+    """Repository interface shared by all storage backends"""
+
+    # ---- keyed collections ----
+    def all_rows(self, table):
+        """Return an ordered dict of key -> record"""
+        raise NotImplementedError
+
+    def get_row(self, table, key, default=None):
+        raise NotImplementedError
+
+    def put_row(self, table, key, record):
+        raise NotImplementedError
+
+    def delete_row(self, table, key):
+        """Delete one record, returns True if it existed"""
+        raise NotImplementedError
+
+    def update_row(self, table, key, update_fn, default=None):
+        """Atomically read a record, pass it to update_fn and store the result"""
+        raise NotImplementedError
+
+    def replace_rows(self, table, rows):
+        """Make the collection equal to rows (dict key -> record), writing only what changed"""
+        raise NotImplementedError
+
+    # ---- append-only logs ----
+    def append(self, log, record, keep=None):
+        """Append one record; if keep is set, the log is trimmed back to the newest keep
+        records once it grows past trim_threshold(keep)"""
+        return self.append_many(log, [record], keep=keep)
+
+    def append_many(self, log, records, keep=None):
+        raise NotImplementedError
+
+    def read_log(self, log, cursor=0, limit=None):
+        """Return (records, cursor) for records appended after cursor"""
+        raise NotImplementedError
+
+    def log_generation(self, log):
+        """Token that changes whenever the log is rewritten, cleared or trimmed.
+
+        Readers that keep a cursor must start again from 0 when it changes.
+        """
+        raise NotImplementedError
+
+    def all_records(self, log):
+        return self.read_log(log)[0]
+
+    def append_numbered(self, log, records, keep=None):
+        """Append records stamped with the next consecutive 'seq' numbers of the log;
+        returns the stamped records. Numbers are never reused, even after trims."""
+        raise NotImplementedError
+
+    def read_numbered(self, log, after=0, limit=None):
+        """Numbered records with seq > after, oldest first (only the newest limit if set)"""
+        raise NotImplementedError
+
+    def last_number(self, log):
+        """Highest seq handed out by append_numbered, 0 if none"""
+        raise NotImplementedError
+
+    def tail(self, log, count):
+        """Return the newest count records, oldest first"""
+        raise NotImplementedError
+
+    def rewrite_log(self, log, records):
+        """Replace the whole log (used for renames and clearing)"""
+        raise NotImplementedError
+
+    def update_record(self, log, fields, update_fn):
+        """Atomically replace the newest record whose fields equal the given
+        values with update_fn(record) (None leaves it alone); returns the new record.
+
+        The new version moves to the end of the log, so readers following the
+        log with a cursor see it like an append and the generation stays the
+        same. A numbered record gets the next seq.
+        """
+        raise NotImplementedError
+
+    def clear_log(self, log):
+        self.rewrite_log(log, [])
+
+    # ---- documents ----
+    def get_document(self, name, default=None):
+        raise NotImplementedError
+
+    def put_document(self, name, value):
+        raise NotImplementedError
+
+    def document_version(self, name):
+        """Token that changes whenever the document is written"""
+        raise NotImplementedError
+
+
+def trim_threshold(keep):
+    """Length at which a log kept to keep records is trimmed back to keep.
+
+    Trimming in batches (about a tenth of keep at a time) instead of on every
+    append keeps the rewrites, and the full re-reads they cause for cached
+    views of the log, rare.
+    """
+    return keep + max(1, keep // 10)
+
+
+def _check_name(name, names):
+    if name not in names:
+        raise KeyError(f"Unknown storage collection: {name}")
+
+
+class JsonStorage(Storage):
+    """Backend that keeps every collection in its original data/*.json file"""
+
+    def __init__(self, data_dir='data'):
+        self.data_dir = data_dir
+        self._lock = threading.RLock()
+        # Lines per journal as far as this process knows (counted once, then
+        # tracked on append), so a keep limit does not re-read the journal
+        self._log_lengths = {}
+        # Highest seq per numbered journal. The counter lives in this process,
+        # so the JSON backend numbers correctly only with a single worker.
+        self._log_numbers = {}
+        os.makedirs(data_dir, exist_ok=True)
+
+    def _path(self, filename):
+        return os.path.join(self.data_dir, filename)
+
+    def _read(self, filename, default):
+        try:
+            with open(self._path(filename), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return default
+
+    def _write(self, filename, data):
+        # Write to a temp file and swap it in so readers never see a half-written file
+        path = self._path(filename)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    # ---- keyed collections ----
+    def _load_table(self, table):
+        _check_name(table, KEYED_TABLES)
+        filename, key_field = KEYED_TABLES[table]
+        if key_field is None:
+            data = self._read(filename, {})
+            return dict(data) if isinstance(data, dict) else {}
+        data = self._read(filename, [])
+        return {record.get(key_field): record for record in data if isinstance(record, dict)}
+
+    def _save_table(self, table, rows):
+        filename, key_field = KEYED_TABLES[table]
+        self._write(filename, dict(rows) if key_field is None else list(rows.values()))
+
+    def all_rows(self, table):
+        with self._lock:
+            return self._load_table(table)
+
+    def get_row(self, table, key, default=None):
+        with self._lock:
+            return self._load_table(table).get(key, default)
+
+    def put_row(self, table, key, record):
+        with self._lock:
+            rows = self._load_table(table)
+            rows[key] = record
+            self._save_table(table, rows)
+
+    def delete_row(self, table, key):
+        with self._lock:
+            rows = self._load_table(table)
+            if key not in rows:
+                return False
+            del rows[key]
+            self._save_table(table, rows)
+            return True
+
+    def update_row(self, table, key, update_fn, default=None):
+        with self._lock:
+            rows = self._load_table(table)
+            record = update_fn(rows.get(key, default))
+            rows[key] = record
+            self._save_table(table, rows)
+            return record
+
+    def replace_rows(self, table, rows):
+        with self._lock:
+            _check_name(table, KEYED_TABLES)
+            self._save_table(table, dict(rows))
+
+    # ---- append-only logs ----
+    def _log_path(self, log):
+        """Path of the .jsonl journal, converting a legacy JSON array file on first use"""
+        _check_name(log, RECORD_LOGS)
+        legacy = self._path(RECORD_LOGS[log])
+        path = os.path.splitext(legacy)[0] + '.jsonl'
+        if not os.path.exists(path) and os.path.exists(legacy):
+            data = self._read(RECORD_LOGS[log], [])
+            self._write_log(path, data if isinstance(data, list) else [])
+        return path
+
+    def _write_log(self, path, records):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+
+    def _read_lines(self, path, offset=0, limit=None):
+        """Parse complete lines from byte offset, returns (records, next offset)"""
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return [], 0
+        records = []
+        consumed = 0
+        # Stop at the last newline so a record being appended is never half-read
+        while limit is None or len(records) < limit:
+            end = chunk.find(b'\n', consumed)
+            if end == -1:
+                break
+            line = chunk[consumed:end].strip()
+            consumed = end + 1
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"[STORAGE] Skipping corrupt line in {path}")
+        return records, offset + consumed
+
+    def append_many(self, log, records, keep=None):
+        with self._lock:
+            path = self._log_path(log)
+            if records:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records))
+            if keep is not None:
+                length = self._log_lengths.get(log)
+                if length is None:
+                    length = len(self._read_lines(path)[0])
+                else:
+                    length += len(records)
+                if length > trim_threshold(keep):
+                    data = self._read_lines(path)[0]
+                    self._write_log(path, data[-keep:])
+                    length = min(len(data), keep)
+                self._log_lengths[log] = length
+
+    def read_log(self, log, cursor=0, limit=None):
+        # The cursor is a byte offset into the journal; a shorter file means
+        # the log was rewritten, so start again from the beginning
+        with self._lock:
+            path = self._log_path(log)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            if cursor > size:
+                cursor = 0
+            return self._read_lines(path, cursor, limit)
+
+    def log_generation(self, log):
+        # Appends keep the file; rewrites swap in a new one via os.replace
+        with self._lock:
+            try:
+                st = os.stat(self._log_path(log))
+            except OSError:
+                return None
+            return f"{st.st_dev}:{st.st_ino}"
+
+    def _number_log(self, log, path):
+        """Highest seq in the journal, numbering records stored without one (once per process)"""
+        last = self._log_numbers.get(log)
+        if last is None:
+            records = self._read_lines(path)[0]
+            last = 0
+            numbered = []
+            for record in records:
+                seq = record.get('seq')
+                if not isinstance(seq, int) or seq <= last:
+                    seq = last + 1
+                    record = dict(record, seq=seq)
+                numbered.append(record)
+                last = seq
+            if numbered != records:
+                self._write_log(path, numbered)
+            self._log_numbers[log] = last
+        return last
+
+    def append_numbered(self, log, records, keep=None):
+        with self._lock:
+            last = self._number_log(log, self._log_path(log))
+            stamped = [dict(record, seq=last + i) for i, record in enumerate(records, 1)]
+            self._log_numbers[log] = last + len(stamped)
+            self.append_many(log, stamped, keep=keep)
+        return stamped
+
+    def read_numbered(self, log, after=0, limit=None):
+        with self._lock:
+            path = self._log_path(log)
+            self._number_log(log, path)
+            records = [r for r in self._read_lines(path)[0] if r.get('seq', 0) > after]
+        return records[-limit:] if limit is not None else records
+
+    def last_number(self, log):
+        with self._lock:
+            return self._number_log(log, self._log_path(log))
+
+    def tail(self, log, count):
+        with self._lock:
+            data = self._read_lines(self._log_path(log))[0]
+        return data[-count:] if count else []
+
+    def rewrite_log(self, log, records):
+        with self._lock:
+            records = list(records)
+            self._write_log(self._log_path(log), records)
+            self._log_lengths[log] = len(records)
+
+    def _find_newest(self, path, fields):
+        """(start, end, record) of the newest journal line whose fields match, or None"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        found = None
+        start = 0
+        while True:
+            end = data.find(b'\n', start)
+            if end == -1:
+                break
+            line = data[start:end].strip()
+            if line:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    record = None
+                if isinstance(record, dict) and all(record.get(k) == v for k, v in fields.items()):
+                    found = (start, end, record)
+            start = end + 1
+        return found
+
+    def update_record(self, log, fields, update_fn):
+        with self._lock:
+            path = self._log_path(log)
+            found = self._find_newest(path, fields)
+            if found and 'seq' in found[2] and log not in self._log_numbers:
+                # Numbering may rewrite the journal, so look the line up again
+                self._number_log(log, path)
+                found = self._find_newest(path, fields)
+            if found is None:
+                return None
+            start, end, record = found
+            updated = update_fn(record)
+            if updated is None:
+                return None
+            if 'seq' in updated:
+                self._log_numbers[log] += 1
+                updated = dict(updated, seq=self._log_numbers[log])
+            # Blank the old line in place (readers skip blank lines) so byte
+            # cursors stay valid, then append the new version
+            with open(path, 'r+b') as f:
+                f.seek(start)
+                f.write(b' ' * (end - start))
+                f.seek(0, os.SEEK_END)
+                f.write((json.dumps(updated, ensure_ascii=False) + '\n').encode('utf-8'))
+            return updated
+
+    # ---- documents ----
+    def get_document(self, name, default=None):
+        _check_name(name, DOCUMENTS)
+        with self._lock:
+            return self._read(DOCUMENTS[name], default)
+
+    def put_document(self, name, value):
+        _check_name(name, DOCUMENTS)
+        with self._lock:
+            self._write(DOCUMENTS[name], value)
+
+    def document_version(self, name):
+        _check_name(name, DOCUMENTS)
+        try:
+            st = os.stat(self._path(DOCUMENTS[name]))
+        except OSError:
+            return None
+        return f"{st.st_dev}:{st.st_ino}:{st.st_mtime_ns}:{st.st_size}"
+
+
+class SQLiteStorage(Storage):
+    """Backend that stores each record as one row of a WAL-mode SQLite database.
+
+    Readers use their own per-thread connection and never block the writer;
+    writes are serialized by a process lock plus SQLite's BEGIN IMMEDIATE, so
+    several gunicorn workers can share one database without losing updates.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._transaction() as conn:
+            for table in KEYED_TABLES:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            for log in RECORD_LOGS:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {log} (seq INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @staticmethod
+    def _dumps(value):
+        return json.dumps(value, ensure_ascii=False)
+
+    # ---- meta ----
+    def get_meta(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value, conn=None):
+        sql = "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+        if conn is not None:
+            conn.execute(sql, (key, value))
+        else:
+            with self._transaction() as conn:
+                conn.execute(sql, (key, value))
+
+    # ---- keyed collections ----
+    def all_rows(self, table):
+        _check_name(table, KEYED_TABLES)
+        rows = self._conn().execute(f"SELECT key, data FROM {table} ORDER BY rowid").fetchall()
+        return {key: json.loads(data) for key, data in rows}
+
+    def get_row(self, table, key, default=None):
+        _check_name(table, KEYED_TABLES)
+        row = self._conn().execute(f"SELECT data FROM {table} WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _upsert(self, conn, table, key, record):
+        # ON CONFLICT ... DO UPDATE keeps the rowid, so collection order is stable
+        conn.execute(
+            f"INSERT INTO {table} (key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (key, self._dumps(record))
+        )
+
+    def put_row(self, table, key, record):
+        _check_name(table, KEYED_TABLES)
+        with self._transaction() as conn:
+            self._upsert(conn, table, key, record)
+
+    def delete_row(self, table, key):
+        _check_name(table, KEYED_TABLES)
+        with self._transaction() as conn:
+            return conn.execute(f"DELETE FROM {table} WHERE key = ?", (key,)).rowcount > 0
+
+    def update_row(self, table, key, update_fn, default=None):
+        _check_name(table, KEYED_TABLES)
+        with self._transaction() as conn:
+            row = conn.execute(f"SELECT data FROM {table} WHERE key = ?", (key,)).fetchone()
+            record = update_fn(json.loads(row[0]) if row else default)
+            self._upsert(conn, table, key, record)
+            return record
+
+    def replace_rows(self, table, rows):
+        _check_name(table, KEYED_TABLES)
+        with self._transaction() as conn:
+            existing = dict(conn.execute(f"SELECT key, data FROM {table}").fetchall())
+            for key, record in rows.items():
+                encoded = self._dumps(record)
+                if existing.get(key) != encoded:
+                    conn.execute(
+                        f"INSERT INTO {table} (key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+                        (key, encoded)
+                    )
+            removed = [(key,) for key in existing if key not in rows]
+            if removed:
+                conn.executemany(f"DELETE FROM {table} WHERE key = ?", removed)
+
+    # ---- append-only logs ----
+    def append_many(self, log, records, keep=None):
+        _check_name(log, RECORD_LOGS)
+        if not records:
+            return
+        with self._transaction() as conn:
+            conn.executemany(f"INSERT INTO {log} (data) VALUES (?)", [(self._dumps(r),) for r in records])
+            if keep is not None:
+                self._trim(conn, log, keep)
+
+    def _trim(self, conn, log, keep):
+        first, last = conn.execute(f"SELECT MIN(seq), MAX(seq) FROM {log}").fetchone()
+        if last is not None and last - first + 1 > trim_threshold(keep):
+            conn.execute(f"DELETE FROM {log} WHERE seq <= ?", (last - keep,))
+            # Cached views of the log must notice the dropped records
+            self._bump_generation(conn, log)
+
+    def append_numbered(self, log, records, keep=None):
+        # The row seq is the record number; AUTOINCREMENT never hands one out
+        # twice, and BEGIN IMMEDIATE keeps the numbers of a batch consecutive
+        # across every process sharing the database
+        _check_name(log, RECORD_LOGS)
+        if not records:
+            return []
+        with self._transaction() as conn:
+            last = self._last_number(conn, log)
+            stamped = [dict(record, seq=last + i) for i, record in enumerate(records, 1)]
+            conn.executemany(f"INSERT INTO {log} (seq, data) VALUES (?, ?)",
+                             [(r['seq'], self._dumps(r)) for r in stamped])
+            if keep is not None:
+                self._trim(conn, log, keep)
+        return stamped
+
+    def read_numbered(self, log, after=0, limit=None):
+        _check_name(log, RECORD_LOGS)
+        sql = f"SELECT seq, data FROM {log} WHERE seq > ? ORDER BY seq DESC"
+        params = (after,)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = (after, limit)
+        rows = self._conn().execute(sql, params).fetchall()
+        # The row seq wins over a stale stamp left in the data by rewrite_log
+        return [dict(json.loads(data), seq=seq) for seq, data in reversed(rows)]
+
+    def last_number(self, log):
+        _check_name(log, RECORD_LOGS)
+        return self._last_number(self._conn(), log)
+
+    @staticmethod
+    def _last_number(conn, log):
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (log,)).fetchone()
+        return row[0] if row else 0
+
+    def read_log(self, log, cursor=0, limit=None):
+        _check_name(log, RECORD_LOGS)
+        sql = f"SELECT seq, data FROM {log} WHERE seq > ? ORDER BY seq"
+        params = (cursor,)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = (cursor, limit)
+        rows = self._conn().execute(sql, params).fetchall()
+        if not rows:
+            return [], cursor
+        return [json.loads(data) for _, data in rows], rows[-1][0]
+
+    def log_generation(self, log):
+        _check_name(log, RECORD_LOGS)
+        return self.get_meta(f'log_generation:{log}', '0')
+
+    def _bump_generation(self, conn, log):
+        self._bump_counter(conn, f'log_generation:{log}')
+
+    def _bump_counter(self, conn, key):
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+            (key,)
+        )
+
+    def tail(self, log, count):
+        _check_name(log, RECORD_LOGS)
+        rows = self._conn().execute(
+            f"SELECT data FROM {log} ORDER BY seq DESC LIMIT ?", (count,)
+        ).fetchall()
+        return [json.loads(data) for (data,) in reversed(rows)]
+
+    def rewrite_log(self, log, records):
+        _check_name(log, RECORD_LOGS)
+        with self._transaction() as conn:
+            conn.execute(f"DELETE FROM {log}")
+            conn.executemany(f"INSERT INTO {log} (data) VALUES (?)", [(self._dumps(r),) for r in records])
+            self._bump_generation(conn, log)
+
+    def update_record(self, log, fields, update_fn):
+        _check_name(log, RECORD_LOGS)
+        where = ' AND '.join(f"json_extract(data, '$.{name}') = ?" for name in fields)
+        with self._transaction() as conn:
+            row = conn.execute(
+                f"SELECT seq, data FROM {log} WHERE {where} ORDER BY seq DESC LIMIT 1", tuple(fields.values())
+            ).fetchone()
+            if row is None:
+                return None
+            updated = update_fn(json.loads(row[1]))
+            if updated is None:
+                return None
+            # Moved to a new seq: cursors pick it up without a generation bump
+            conn.execute(f"DELETE FROM {log} WHERE seq = ?", (row[0],))
+            seq = conn.execute(f"INSERT INTO {log} (data) VALUES (?)", (self._dumps(updated),)).lastrowid
+            if 'seq' in updated:
+                updated = dict(updated, seq=seq)
+                conn.execute(f"UPDATE {log} SET data = ? WHERE seq = ?", (self._dumps(updated), seq))
+            return updated
+
+    # ---- documents ----
+    def get_document(self, name, default=None):
+        _check_name(name, DOCUMENTS)
+        row = self._conn().execute("SELECT data FROM documents WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def put_document(self, name, value):
+        _check_name(name, DOCUMENTS)
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO documents (name, data) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+                (name, self._dumps(value))
+            )
+            self._bump_counter(conn, f'document_version:{name}')
+
+    def document_version(self, name):
+        _check_name(name, DOCUMENTS)
+        return self.get_meta(f'document_version:{name}', '0')
+
+
+def migrate_json_to_sqlite(data_dir, db_path, force=False):
+    """One-shot import of the legacy data/*.json files into the SQLite database.
+
+    Returns a dict of collection -> record count, or None if the database was
+    already migrated (pass force=True to re-import and overwrite).
+    """
+    source = JsonStorage(data_dir)
+    target = db_path if isinstance(db_path, SQLiteStorage) else SQLiteStorage(db_path)
+
+    with target._transaction() as conn:
+        already = conn.execute("SELECT value FROM meta WHERE key = 'json_migrated_at'").fetchone()
+        if already and not force:
+            return None
+
+        counts = {}
+        for table in KEYED_TABLES:
+            rows = source.all_rows(table)
+            conn.execute(f"DELETE FROM {table}")
+            for key, record in rows.items():
+                if key is None:
+                    continue
+                target._upsert(conn, table, key, record)
+            counts[table] = len(rows)
+
+        for log in RECORD_LOGS:
+            records = source.all_records(log)
+            conn.execute(f"DELETE FROM {log}")
+            conn.executemany(f"INSERT INTO {log} (data) VALUES (?)", [(target._dumps(r),) for r in records])
+            target._bump_generation(conn, log)
+            counts[log] = len(records)
+
+        for name in DOCUMENTS:
+            document = source.get_document(name)
+            if document is not None:
+                conn.execute(
+                    "INSERT INTO documents (name, data) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+                    (name, target._dumps(document))
+                )
+                target._bump_counter(conn, f'document_version:{name}')
+            counts[name] = 0 if document is None else 1
+
+        target.set_meta('json_migrated_at', str(time.time()), conn=conn)
+
+    return counts
+
+
+def open_storage(backend='sqlite', data_dir='data', db_path='data/app.db'):
+    """Open the configured storage backend ('sqlite' or 'json')"""
+    if backend == 'json':
+        return JsonStorage(data_dir)
+    if backend == 'sqlite':
+        storage = SQLiteStorage(db_path)
+        # First start on a fresh database: import the existing JSON files once
+        counts = migrate_json_to_sqlite(data_dir, storage)
+        if counts is not None:
+            print(f"[STORAGE] Imported data/*.json into {db_path}: {counts}")
+        return storage
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+if __name__ == "__main__":
+    # Usage: python storage.py migrate [--force]
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print("Usage: python storage.py migrate [--force]")
+        sys.exit(1)
+    from config import STORAGE_DB_PATH
+    result = migrate_json_to_sqlite('data', STORAGE_DB_PATH, force='--force' in sys.argv)
+    if result is None:
+        print(f"{STORAGE_DB_PATH} was already migrated. Use --force to re-import the JSON files.")
+    else:
+        print(f"Migrated into {STORAGE_DB_PATH}: {result}")
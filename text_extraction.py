@@ -0,0 +1,207 @@
+# Text extraction for teacher uploads.
+#
+# iter_document_text() yields a document a page (PDF) or paragraph (DOCX) at a
+# time instead of building one ever-growing string. TextExtractor runs that
+# generator in a separate worker process, which streams the text straight into
+# a cache file named after the SHA-256 of the upload, so a slow PDF never ties
+# up a web worker and uploading the same file again skips extraction entirely.
+# The cache directory is kept under max_bytes by evicting the least recently
+# used files.
+import os
+import time
+import uuid
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+TEXT_EXTENSIONS = ('.txt', '.md')
+WORKER_EXTENSIONS = ('.pdf', '.docx')
+
+
+class UnsupportedDocument(Exception):
+    pass
+
+
+def iter_document_text(file_path):
+    """Yield the text of a document piece by piece (pages for PDF, paragraphs otherwise)"""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in TEXT_EXTENSIONS:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield line
+    elif extension == '.pdf':
+        import PyPDF2
+        with open(file_path, 'rb') as f:
+            reader = PyPDF2.PdfReader(f)
+            for page in reader.pages:
+                yield (page.extract_text() or '') + '\n'
+    elif extension == '.docx':
+        from docx import Document
+        for paragraph in Document(file_path).paragraphs:
+            yield paragraph.text + '\n'
+    else:
+        raise UnsupportedDocument(extension)
+
+
+def extract_to_file(file_path, target):
+    """Write the document's text to target; returns the number of characters written"""
+    temp = f"{target}.{uuid.uuid4().hex}.tmp"
+    written = 0
+    try:
+        with open(temp, 'w', encoding='utf-8') as out:
+            for piece in iter_document_text(file_path):
+                out.write(piece)
+                written += len(piece)
+        os.replace(temp, target)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+    return written
+
+
+def file_digest(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TextExtractor:
+    """Extracts upload text in a worker process, cached on disk by content hash"""
+
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024, timeout=120, workers=1):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'extracted_chars': 0,
+            'evictions': 0,
+            'timeouts': 0,
+            'errors': 0,
+        }
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _pool(self):
+        # Created lazily so each forked web worker gets its own pool. Worker
+        # processes are spawned, not forked: the web process runs several
+        # threads, and a fork taken while one of them holds a lock (logging,
+        # SQLite, the HTTP pool) can deadlock the child. The worker entry point
+        # lives in this module, which imports nothing from app.py. When app.py
+        # itself is the __main__ script, multiprocessing runs it once more in
+        # each new worker process (as __mp_main__). The pool is kept between
+        # uploads, so that cost is paid once per pool, not per extraction.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _reset_pool(self, kill=False):
+        with self._lock:
+            if self._executor is not None:
+                if kill:
+                    # shutdown() alone would let a stuck parse run to completion
+                    for process in list(getattr(self._executor, '_processes', {}).values()):
+                        process.terminate()
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def cache_path(self, file_path):
+        extension = os.path.splitext(file_path)[1].lower()
+        return os.path.join(self.cache_dir, f"{file_digest(file_path)}{extension}.txt")
+
+    def extract(self, file_path):
+        """Text of the document; raises UnsupportedDocument, ImportError, TimeoutError or the parser's error"""
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension not in TEXT_EXTENSIONS + WORKER_EXTENSIONS:
+            raise UnsupportedDocument(extension)
+        cached = self.cache_path(file_path)
+        if os.path.exists(cached):
+            self.counters['hits'] += 1
+            os.utime(cached)  # mark as recently used for eviction
+            return self._read(cached)
+
+        self.counters['misses'] += 1
+        try:
+            if extension in TEXT_EXTENSIONS:
+                written = extract_to_file(file_path, cached)
+            else:
+                written = self._extract_in_worker(file_path, cached)
+        except Exception:
+            self.counters['errors'] += 1
+            raise
+        self.counters['extracted_chars'] += written
+        text = self._read(cached)
+        self.evict()
+        return text
+
+    def _extract_in_worker(self, file_path, target):
+        future = self._pool().submit(extract_to_file, file_path, target)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # A runaway parse must not keep the worker busy for the next upload
+            self.counters['timeouts'] += 1
+            self._reset_pool(kill=True)
+            raise
+        except BrokenProcessPool:
+            self._reset_pool()
+            raise
+
+    def _read(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def evict(self):
+        """Delete least recently used cache files until the cache fits in max_bytes"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith('.tmp'):
+                # Left behind by a worker that was killed mid-write
+                if stat.st_mtime < time.time() - 3600:
+                    self._remove(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if self._remove(path):
+                total -= size
+                removed += 1
+        self.counters['evictions'] += removed
+        return removed
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def stats(self):
+        stats = dict(self.counters)
+        try:
+            names = [n for n in os.listdir(self.cache_dir) if n.endswith('.txt')]
+            stats['cached_files'] = len(names)
+            stats['cached_bytes'] = sum(os.path.getsize(os.path.join(self.cache_dir, n)) for n in names)
+        except OSError:
+            pass
+        stats['max_bytes'] = self.max_bytes
+        return stats
@@ -0,0 +1,153 @@
+# Cache of AI grading verdicts.
+#
+# Two tiers: an in-process LRU answers repeat lookups without any I/O, and a
+# keyed table in the storage backend keeps verdicts across restarts and shares
+# them between worker processes. Entries are keyed by question id, a hash of
+# the answer key (question text, expected answer, keywords) and the normalized
+# student answer, so editing a question's answer never reuses old verdicts.
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def normalize_student_answer(answer):
+    """Lowercase and collapse whitespace so trivially different answers share a verdict"""
+    return ' '.join(str(answer).lower().split())
+
+
+def answer_key_hash(question, correct_answer, keywords=None):
+    """Hash of everything the verdict depends on besides the student's answer"""
+    if isinstance(keywords, str):
+        keywords = keywords.split(',')
+    parts = [str(question or '').strip(), str(correct_answer or '').strip().lower()]
+    parts.extend(sorted(str(k).strip().lower() for k in (keywords or []) if str(k).strip()))
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+class VerdictCache:
+    """In-process LRU in front of a persistent storage table"""
+
+    def __init__(self, storage, table='ai_verdicts', max_entries=2048, ttl=7 * 24 * 3600,
+                 prune_every=500):
+        self.storage = storage
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts_since_prune = 0
+        self.counters = {
+            'memory_hits': 0,
+            'store_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expired': 0,
+            'invalidated': 0,
+            'store_errors': 0,
+        }
+
+    @staticmethod
+    def make_key(question_id, answer_key, student_answer):
+        digest = hashlib.sha256(normalize_student_answer(student_answer).encode('utf-8')).hexdigest()[:24]
+        return f"{question_id}:{answer_key}:{digest}"
+
+    def get(self, key):
+        """Cached verdict dict, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                if entry['expires_at'] > now:
+                    self._lru.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    return dict(entry['verdict'])
+                del self._lru[key]
+                self.counters['expired'] += 1
+
+        try:
+            entry = self.storage.get_row(self.table, key)
+        except Exception as e:
+            self.counters['store_errors'] += 1
+            print(f"[AI CACHE] Lookup failed: {e}")
+            entry = None
+        if entry is not None and entry.get('expires_at', 0) > now:
+            self._remember(key, entry)
+            self.counters['store_hits'] += 1
+            return dict(entry['verdict'])
+        if entry is not None:
+            self.counters['expired'] += 1
+            self._delete_stored(key)
+        self.counters['misses'] += 1
+        return None
+
+    def put(self, key, verdict, question_id=None):
+        entry = {
+            'verdict': dict(verdict),
+            'question_id': question_id,
+            'expires_at': time.time() + self.ttl,
+        }
+        self._remember(key, entry)
+        try:
+            self.storage.put_row(self.table, key, entry)
+            self.counters['stores'] += 1
+        except Exception as e:
+            self.counters['store_errors'] += 1
+            print(f"[AI CACHE] Store failed: {e}")
+        self._puts_since_prune += 1
+        if self._puts_since_prune >= self.prune_every:
+            self._puts_since_prune = 0
+            self.prune()
+
+    def invalidate(self, question_id):
+        """Drop every verdict for a question (its answer or keywords changed)"""
+        prefix = f"{question_id}:"
+        with self._lock:
+            stale = [key for key in self._lru if key.startswith(prefix)]
+            for key in stale:
+                del self._lru[key]
+        removed = self._drop_stored(lambda key, entry: key.startswith(prefix))
+        self.counters['invalidated'] += max(removed, len(stale))
+        return removed
+
+    def prune(self):
+        """Delete expired verdicts from the persistent tier"""
+        now = time.time()
+        removed = self._drop_stored(lambda key, entry: entry.get('expires_at', 0) <= now)
+        self.counters['expired'] += removed
+        return removed
+
+    def stats(self):
+        stats = dict(self.counters)
+        lookups = stats['memory_hits'] + stats['store_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['store_hits']) / lookups, 3) if lookups else 0.0
+        stats['memory_entries'] = len(self._lru)
+        return stats
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._lru[key] = entry
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def _delete_stored(self, key):
+        try:
+            self.storage.delete_row(self.table, key)
+        except Exception as e:
+            print(f"[AI CACHE] Delete failed: {e}")
+
+    def _drop_stored(self, should_drop):
+        try:
+            rows = self.storage.all_rows(self.table)
+            kept = {key: entry for key, entry in rows.items() if not should_drop(key, entry)}
+            if len(kept) != len(rows):
+                self.storage.replace_rows(self.table, kept)
+            return len(rows) - len(kept)
+        except Exception as e:
+            self.counters['store_errors'] += 1
+            print(f"[AI CACHE] Cleanup failed: {e}")
+            return 0